@@ -9,6 +9,7 @@ import ssl
 import time
 from http.client import HTTPResponse
 from pathlib import Path
+from typing import TYPE_CHECKING
 from typing import Any
 from typing import Dict
 from typing import List
@@ -20,8 +21,6 @@ from urllib.request import Request
 from urllib.request import urlopen
 
 import certifi
-from rich.panel import Panel
-from rich.progress import Progress
 
 from cr import DOCS_LINK
 from cr import LOGGER
@@ -51,6 +50,18 @@ from cr.utils import wagtail_settings_fix
 from cr.utils import wordpress_wpconfig_check
 
 
+if TYPE_CHECKING:
+    from rich.progress import Progress
+
+
+# Use orjson to parse responses when it happens to be installed (it is not
+# a required dependency); otherwise fall back to the stdlib parser.
+try:
+    from orjson import loads as _json_loads  # type: ignore
+except ImportError:
+    _json_loads = json.loads
+
+
 class DatabaseServer:
     def __init__(self, hostname: str, db_type: DatabaseType):
         self.hostname: str = hostname
@@ -116,6 +127,13 @@ class Webapp:
         """
         return getattr(self, f"{self.env}_dbserver")
 
+    @property
+    def sftp_domain(self) -> str:
+        """
+        Return the SFTP domain based on environment.
+        """
+        return getattr(self, f"sftp_{self.env}_domain")
+
     def local_check(self, p: Path, c: Optional[Console]) -> None:
         """
         Check that provided Path ``p`` appears to contain a valid AppType
@@ -276,8 +294,9 @@ class Webapp:
             ):
                 raise UserCancelError()
 
-        # Check for un-pushed.
-        if git_unpushed():
+        # Check for un-pushed. The branch was already queried above, so
+        # pass it along rather than spawning git again.
+        if git_unpushed(b):
             if c and not c.prompt_yn(
                 "You have changes which are NOT PUSHED to git!\n"
                 "It is recommended to push your changes before deploying.\n"
@@ -431,18 +450,27 @@ class Webapp:
             raise Exception("Error getting deployment log.")
         return d["returned_data"]
 
-    def api_poll_logs(self, progress: Progress) -> None:
+    def api_poll_logs(self, progress: "Progress") -> None:
         """
         Poll deployment logs until EOT is found, or a fixed amount of time,
         and print to Progress.
+
+        Polling starts out quick and backs off exponentially to 10 second
+        intervals while the logs are quiet, resetting whenever new lines
+        arrive.
         """
         kill = False
         since = 0
-        for i in range(18):
+        deadline = time.monotonic() + 180
+        wait = 1.0
+        while True:
             data = self.api_get_logs(since=since)
             logs = data["logs"]
             if not logs:
                 kill = True
+            else:
+                # New output arrived; poll quickly again.
+                wait = 1.0
             for line in logs:
                 text = line["log"]
                 since = line["datetime"]
@@ -458,9 +486,10 @@ class Webapp:
                 if "\x04" in text:
                     kill = True
                 time.sleep(0.05)
-            if kill:
+            if kill or time.monotonic() >= deadline:
                 break
-            time.sleep(10)
+            time.sleep(wait)
+            wait = min(wait * 2, 10.0)
 
     def api_get_task(self, task_id: int) -> dict:
         """
@@ -478,18 +507,24 @@ class Webapp:
 
     def api_poll_task(self, task_id: int) -> dict:
         """
-        Blocking function to poll a task every 10
-        seconds until it completes or errors out.
+        Blocking function to poll a task until it completes or errors out.
+        Polling starts out quick, to catch short tasks with low latency, and
+        backs off exponentially to every 10 seconds.
 
         Returns the completed or errored task dict.
 
         Raises TimeoutError if the task does not complete after 3 minutes.
         """
-        for i in range(18):
+        deadline = time.monotonic() + 180
+        wait = 1.0
+        while True:
             d = self.api_get_task(task_id)
             if d["status"] != "queued":
                 return d
-            time.sleep(10)
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(wait)
+            wait = min(wait * 2, 10.0)
         raise TimeoutError(f"Task ID {task_id} has not completed.")
 
 
@@ -500,7 +535,7 @@ def _response_to_json(r: Union[HTTPResponse, HTTPError]) -> dict:
     text = r.read().decode("utf8")
     d = {}
     if text:
-        d = json.loads(text)
+        d = _json_loads(text)
     LOGGER.debug("Parsed: %s", d)
     return d
 
@@ -586,32 +621,80 @@ def coderedapi(
     return (code, d)
 
 
+_UPDATE_CACHE_PATH = Path("~/.cache/cr/update_check.json").expanduser()
+"""
+File caching the most recent release lookup, to avoid a network call on
+every invocation.
+"""
+
+_UPDATE_CACHE_SECONDS = 60 * 60 * 24
+"""
+How long a cached release lookup remains fresh.
+"""
+
+
+def _read_update_cache() -> Optional[str]:
+    """
+    Returns the cached latest version string, or None if the cache is
+    missing, stale, or unreadable.
+    """
+    try:
+        d = json.loads(_UPDATE_CACHE_PATH.read_text())
+        if time.time() - d["last_check"] < _UPDATE_CACHE_SECONDS:
+            return str(d["latest"])
+    except Exception:
+        pass
+    return None
+
+
+def _write_update_cache(latest: str) -> None:
+    """
+    Saves the latest version string to the cache file. Failure to write is
+    ignored (e.g. read-only home directory).
+    """
+    try:
+        _UPDATE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _UPDATE_CACHE_PATH.write_text(
+            json.dumps({"last_check": time.time(), "latest": latest})
+        )
+    except OSError as exc:
+        LOGGER.warning("Could not write update cache.", exc_info=exc)
+
+
 def check_update(c: Optional[Console] = None) -> Tuple[bool, Optional[str]]:
     """
     Check if a new version is available and print to Console ``c``.
     If this fails or takes longer than 1 second, simply ignore it.
 
+    The lookup is cached on disk for 24 hours, so most invocations do not
+    touch the network at all.
+
     Returns tuple of (bool, new version string).
     """
-    try:
-        _, gh = request_json(
-            "https://api.github.com/repos/coderedcorp/cr/releases/latest",
-            timeout=1,
-        )
-        newver = gh["tag_name"].strip("vV")
-        if VERSION != newver:
-            if c:
-                p = Panel(
-                    f"Newer version of cr [cr.code]{newver}[/] is available!\n"
-                    f"See: {DOCS_LINK}",
-                    border_style="cr.update_border",
-                )
-                c.print(p)
-            return (True, newver)
-        return (False, newver)
-    except Exception as exc:
-        LOGGER.warning("Error checking for update.", exc_info=exc)
-    return (False, None)
+    newver = _read_update_cache()
+    if newver is None:
+        try:
+            _, gh = request_json(
+                "https://api.github.com/repos/coderedcorp/cr/releases/latest",
+                timeout=1,
+            )
+            newver = gh["tag_name"].strip("vV")
+            _write_update_cache(newver)
+        except Exception as exc:
+            LOGGER.warning("Error checking for update.", exc_info=exc)
+            return (False, None)
+    if VERSION != newver:
+        if c:
+            from rich.panel import Panel
+
+            p = Panel(
+                f"Newer version of cr [cr.code]{newver}[/] is available!\n"
+                f"See: {DOCS_LINK}",
+                border_style="cr.update_border",
+            )
+            c.print(p)
+        return (True, newver)
+    return (False, newver)
 
 
 def _prompt_filenotfound(
@@ -26,39 +26,64 @@ Copyright (c) 2022-2024 CodeRed LLC.
 import argparse
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pathlib import PurePosixPath
+from typing import TYPE_CHECKING
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
 
-from rich.logging import RichHandler
-from rich.progress import BarColumn
-from rich.progress import MofNCompleteColumn
-from rich.progress import TaskProgressColumn
-from rich.progress import TextColumn
-from rich.progress import TimeElapsedColumn
+from rich.text import Text
 
 from cr import DOCS_LINK
 from cr import LOGGER
 from cr import VERSION
+from cr import Env
 from cr import UserCancelError
-from cr.api import Env
-from cr.api import Webapp
-from cr.api import check_update
 from cr.config import config
 from cr.config import config_path_list
 from cr.config import config_pureposixpath_list
 from cr.config import load_config
 from cr.rich_utils import CONSOLE
 from cr.rich_utils import CONSOLE_ERR
-from cr.rich_utils import Progress
 from cr.rich_utils import RichArgparseFormatter
 from cr.rich_utils import SphinxArgparseFormatter
 from cr.rich_utils import osc_reset
-from cr.ssh import Server
 from cr.utils import check_handle
 from cr.utils import git_ignored
 from cr.utils import paths_to_deploy
 
 
+if TYPE_CHECKING:
+    from cr.api import Webapp
+
+
+# Status messages printed above the progress bar. Pre-built as ``Text``
+# so repeat prints skip rich's markup parsing and style resolution.
+_MSG_QUEUED_PREFIX = Text(
+    "[deployment queued with ID: ", style="logging.level.info"
+)
+_MSG_DEPLOY_LOGS = Text("[getting deployment logs]", style="logging.level.info")
+_MSG_GETTING_LOGS = Text("[getting logs]", style="logging.level.info")
+_MSG_CLOSED = Text("[connection closed]", style="logging.level.info")
+
+
+# Default remote directories excluded from ``cr download``.
+_DEFAULT_DOWNLOAD_EXCLUDE = [
+    PurePosixPath("cache"),
+    PurePosixPath("static"),
+    PurePosixPath("wp-content/cache"),
+]
+
+
+# NOTE: ``rich.logging``, ``rich.progress``, ``cr.api``, and ``cr.ssh``
+# (which pulls in paramiko/cryptography) are intentionally imported within
+# the functions that need them. This keeps simple invocations such as
+# ``cr --help`` and ``cr --version`` from paying the full import cost.
+
+
 class CustomArgumentParser(argparse.ArgumentParser):
     """
     Customizes the appearance of argparse help and output.
@@ -71,11 +96,26 @@ class CustomArgumentParser(argparse.ArgumentParser):
         super().__init__(*args, **kwargs)
         self._optionals.title = "Options"
         self._positionals.title = "Required"
+        self._cached_usage: Optional[str] = None
+        self._cached_help: Optional[str] = None
+
+    def add_argument(self, *args, **kwargs):
+        """
+        Override to invalidate the memoized help/usage text.
+        """
+        self._cached_usage = None
+        self._cached_help = None
+        return super().add_argument(*args, **kwargs)
 
     def format_usage(self):
         """
         Override to add usage prefix, for consistency with ``format_help()``
+
+        Formatting involves measuring every action, so the result is
+        memoized for repeat calls within the same process.
         """
+        if self._cached_usage is not None:
+            return self._cached_usage
         formatter = self._get_formatter()
         formatter.add_usage(
             self.usage,
@@ -83,12 +123,18 @@ class CustomArgumentParser(argparse.ArgumentParser):
             self._mutually_exclusive_groups,
             prefix="Usage",
         )
-        return formatter.format_help()
+        self._cached_usage = formatter.format_help()
+        return self._cached_usage
 
     def format_help(self):
         """
         Override to apply slightly more customized help formatting.
+
+        Formatting involves measuring every action, so the result is
+        memoized for repeat calls within the same process.
         """
+        if self._cached_help is not None:
+            return self._cached_help
         formatter = self._get_formatter()
 
         # description
@@ -116,15 +162,8 @@ class CustomArgumentParser(argparse.ArgumentParser):
         formatter.add_text(f"Full documentation at: {DOCS_LINK}")
 
         # determine help from format above
-        return formatter.format_help()
-
-    def error(self, message):
-        """
-        Override to show a more friendly help message.
-        """
-        CONSOLE.print(f"{self.prog}: {message}")
-        CONSOLE.print(f"See ``{self.prog} --help``.")
-        self.exit(2)
+        self._cached_help = formatter.format_help()
+        return self._cached_help
 
 
 class RichArgumentParser(CustomArgumentParser):
@@ -136,6 +175,14 @@ class RichArgumentParser(CustomArgumentParser):
         kwargs["formatter_class"] = RichArgparseFormatter
         super().__init__(*args, **kwargs)
 
+    def error(self, message):
+        """
+        Override to show a more friendly help message.
+        """
+        CONSOLE.print(f"{self.prog}: {message}")
+        CONSOLE.print(f"See ``{self.prog} --help``.")
+        self.exit(2)
+
 
 class SphinxArgumentParser(CustomArgumentParser):
     """
@@ -153,6 +200,8 @@ class Arg:
     Simple struct to hold re-usable add_argument() definitions.
     """
 
+    __slots__ = ("args", "kwargs")
+
     def __init__(self, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
@@ -168,7 +217,9 @@ arg_env = Arg(
 arg_path = Arg(
     "--path",
     type=Path,
-    default=Path.cwd(),
+    # Use a relative path rather than ``Path.cwd()`` to avoid a getcwd
+    # syscall at import time; ``get_webapp()`` resolves it before use.
+    default=Path("."),
     help=(
         "Path to folder containing the source code for the website. "
         "For Django & Wagtail, this is the folder with ``manage.py``. "
@@ -205,10 +256,12 @@ class Command:
         pass
 
     @classmethod
-    def get_webapp(self, args: argparse.Namespace) -> Webapp:
+    def get_webapp(self, args: argparse.Namespace) -> "Webapp":
         """
         Loads the Webapp and parses common arguments.
         """
+        from cr.api import Webapp
+
         # First check if the webapp handle could be valid.
         # If it's not, immediately throw an error.
         if not check_handle(args.webapp):
@@ -219,10 +272,15 @@ class Command:
 
         # Resolve path, if provided.
         extra_configs = []
-        if hasattr(args, "path"):
-            args.path = args.path.expanduser().resolve()
-            if args.path.is_dir():
-                extra_configs = [args.path / ".cr.ini"]
+        path = getattr(args, "path", None)
+        if path is not None:
+            path = path.expanduser().resolve()
+            args.path = path
+            # Stat once; commands re-use this instead of calling is_dir()
+            # again.
+            args.path_is_dir = path.is_dir()
+            if args.path_is_dir:
+                extra_configs = [path / ".cr.ini"]
 
         # Load configs, including path if provided.
         load_config(extra_configs)
@@ -273,6 +331,14 @@ class Deploy(Command):
 
     @classmethod
     def run(self, args: argparse.Namespace):
+        from rich.progress import BarColumn
+        from rich.progress import MofNCompleteColumn
+        from rich.progress import TaskProgressColumn
+        from rich.progress import TextColumn
+        from rich.progress import TimeElapsedColumn
+
+        from cr.rich_utils import Progress
+
         w = self.get_webapp(args)
         if not args.no_upload:
             w.local_check(args.path, CONSOLE)
@@ -286,24 +352,35 @@ class Deploy(Command):
             TaskProgressColumn(),
             TimeElapsedColumn(),
             console=CONSOLE,
+            refresh_per_second=4,
         ) as pbar:
+            queue_future = None
             if not args.no_upload:
+                # Generate a new SFTP password from CodeRed Cloud API in the
+                # background, overlapping the network round-trip with the
+                # local file enumeration below.
+                pool = ThreadPoolExecutor(max_workers=1)
+                passwd_future = pool.submit(w.api_get_sftp_password)
+
+                # Import paramiko-backed SSH support while the password
+                # request is in flight.
+                from cr.ssh import Server
+
                 # Get list of paths to copy.
                 exclude = git_ignored(args.path)
-                exclude += config_path_list("deploy_exclude", args.webapp, [])
+                exclude.update(
+                    config_path_list("deploy_exclude", args.webapp, [])
+                )
                 include = config_path_list("deploy_include", args.webapp, [])
                 files = paths_to_deploy(args.path, e=exclude, i=include)
-                s = Server(getattr(w, f"sftp_{args.env}_domain"), w.handle, "")
+                s = Server(w.sftp_domain, w.handle, "")
 
                 # Get credentials and connect.
                 t = pbar.add_task("Connecting", total=None)
 
-                # Generate a new SFTP password from CodeRed Cloud API.
-                passwd = w.api_get_sftp_password()
-
                 try:
                     # Connect to the webapp's server.
-                    s.passwd = passwd
+                    s.passwd = passwd_future.result()
                     s.connect()
 
                     # Initiate SFTP mode.
@@ -312,43 +389,45 @@ class Deploy(Command):
 
                     # Copy files.
                     s.put(
-                        files, args.path, PurePosixPath("/www"), progress=pbar
+                        files,
+                        args.path,
+                        PurePosixPath("/www"),
+                        progress=pbar,
+                        max_workers=8,
                     )
+
+                    # Queue the deployment task in the background while the
+                    # SFTP session tears down.
+                    queue_future = pool.submit(w.api_queue_deploy)
                 finally:
                     s.close()
+                    pool.shutdown(wait=False)
 
             # Queue the deployment task.
             t = pbar.add_task("Deploying", total=None)
-            api_task_id = w.api_queue_deploy()
-            pbar.print(
-                f"[deployment queued with ID: {api_task_id}]",
-                markup=False,
-                style="logging.level.info",
-            )
+            if queue_future is not None:
+                api_task_id = queue_future.result()
+            else:
+                api_task_id = w.api_queue_deploy()
+            msg = _MSG_QUEUED_PREFIX.copy()
+            msg.append(f"{api_task_id}]")
+            pbar.print(msg)
 
             # Poll the deployment task until it completes or times out.
             api_task = w.api_poll_task(api_task_id)
             if api_task["status"] != "completed":
-                msg = "Please contact support for assistance."
-                if "error" in api_task:
-                    msg = api_task["error"]
-                if (
-                    "returned_data" in api_task
-                    and "error" in api_task["returned_data"]
-                ):
-                    msg = api_task["returned_data"]["error"]
+                msg = api_task.get("returned_data", {}).get(
+                    "error",
+                    api_task.get(
+                        "error", "Please contact support for assistance."
+                    ),
+                )
                 raise Exception(f"Deployment encountered an error: {msg}")
 
             # Now poll the logs.
-            pbar.print(
-                "[getting deployment logs]",
-                markup=False,
-                style="logging.level.info",
-            )
+            pbar.print(_MSG_DEPLOY_LOGS)
             w.api_poll_logs(pbar)
-            pbar.print(
-                "[connection closed]", markup=False, style="logging.level.info"
-            )
+            pbar.print(_MSG_CLOSED)
             pbar.update(t, total=1, completed=1)
 
         CONSOLE.print(f"\nYour site is live at: {w.url}\n")
@@ -418,21 +497,24 @@ class Logs(Command):
 
     @classmethod
     def run(self, args: argparse.Namespace):
+        from rich.progress import BarColumn
+        from rich.progress import TextColumn
+        from rich.progress import TimeElapsedColumn
+
+        from cr.rich_utils import Progress
+
         w = self.get_webapp(args)
         with Progress(
             TextColumn("[progress.description]{task.description}"),
             BarColumn(),
             TimeElapsedColumn(),
             console=CONSOLE,
+            refresh_per_second=4,
         ) as pbar:
             t = pbar.add_task("Getting logs", total=None)
-            pbar.print(
-                "[getting logs]", markup=False, style="logging.level.info"
-            )
+            pbar.print(_MSG_GETTING_LOGS)
             w.api_poll_logs(pbar)
-            pbar.print(
-                "[connection closed]", markup=False, style="logging.level.info"
-            )
+            pbar.print(_MSG_CLOSED)
             pbar.update(t, completed=1, total=1)
 
 
@@ -453,7 +535,7 @@ class Download(Command):
         p.add_argument(
             "--path",
             type=Path,
-            default=Path.cwd(),
+            default=Path("."),
             help=(
                 "Directory in which to download the files. "
                 "Defaults to the current directory."
@@ -483,6 +565,15 @@ class Download(Command):
 
     @classmethod
     def run(self, args: argparse.Namespace):
+        from rich.progress import BarColumn
+        from rich.progress import MofNCompleteColumn
+        from rich.progress import TaskProgressColumn
+        from rich.progress import TextColumn
+        from rich.progress import TimeElapsedColumn
+
+        from cr.rich_utils import Progress
+        from cr.ssh import Server
+
         w = self.get_webapp(args)
 
         exclude = args.exclude
@@ -490,11 +581,7 @@ class Download(Command):
             exclude = config_pureposixpath_list(
                 "download_exclude",
                 args.webapp,
-                [
-                    PurePosixPath("cache"),
-                    PurePosixPath("static"),
-                    PurePosixPath("wp-content/cache"),
-                ],
+                _DEFAULT_DOWNLOAD_EXCLUDE,
             )
 
         with Progress(
@@ -504,8 +591,9 @@ class Download(Command):
             TaskProgressColumn(),
             TimeElapsedColumn(),
             console=CONSOLE,
+            refresh_per_second=4,
         ) as pbar:
-            s = Server(getattr(w, f"sftp_{args.env}_domain"), w.handle, "")
+            s = Server(w.sftp_domain, w.handle, "")
 
             # Get credentials and connect.
             t = pbar.add_task("Connecting", total=None)
@@ -523,7 +611,13 @@ class Download(Command):
                 pbar.update(t, total=1, completed=1)
 
                 # Copy files.
-                s.get(args.remote, args.path, e=exclude, progress=pbar)
+                s.get(
+                    args.remote,
+                    args.path,
+                    e=exclude,
+                    progress=pbar,
+                    max_workers=8,
+                )
             finally:
                 s.close()
 
@@ -541,7 +635,7 @@ class Upload(Command):
         p.add_argument(
             "--path",
             type=Path,
-            default=Path.cwd(),
+            default=Path("."),
             help=(
                 "Path to a file or folder to upload. "
                 "If this is a file, it will be uploaded into --remote. "
@@ -573,11 +667,19 @@ class Upload(Command):
 
     @classmethod
     def run(self, args: argparse.Namespace):
+        from rich.progress import BarColumn
+        from rich.progress import MofNCompleteColumn
+        from rich.progress import TaskProgressColumn
+        from rich.progress import TextColumn
+        from rich.progress import TimeElapsedColumn
+
+        from cr.rich_utils import Progress
+
         w = self.get_webapp(args)
 
         # If the destination is the usual ``/www`` dir, and ``--path`` is a
         # directory, confirm with the user.
-        if args.remote == PurePosixPath("/www") and args.path.is_dir():
+        if args.remote == PurePosixPath("/www") and args.path_is_dir:
             w.local_check(args.path, CONSOLE)
             if not args.skip_predeploy:
                 w.local_predeploy(args.path, CONSOLE)
@@ -589,26 +691,37 @@ class Upload(Command):
             TaskProgressColumn(),
             TimeElapsedColumn(),
             console=CONSOLE,
+            refresh_per_second=4,
         ) as pbar:
+            # Generate a new SFTP password from CodeRed Cloud API in the
+            # background, overlapping the network round-trip with the
+            # local file enumeration below.
+            pool = ThreadPoolExecutor(max_workers=1)
+            passwd_future = pool.submit(w.api_get_sftp_password)
+
+            # Import paramiko-backed SSH support while the password
+            # request is in flight.
+            from cr.ssh import Server
+
             # Get list of paths to copy.
-            if args.path.is_dir():
+            files: Iterable[Tuple[Path, bool]]
+            if args.path_is_dir:
                 exclude = git_ignored(args.path)
-                exclude += config_path_list("deploy_exclude", args.webapp, [])
+                exclude.update(
+                    config_path_list("deploy_exclude", args.webapp, [])
+                )
                 include = config_path_list("deploy_include", args.webapp, [])
                 files = paths_to_deploy(args.path, e=exclude, i=include)
             else:
-                files = [args.path]
-            s = Server(getattr(w, f"sftp_{args.env}_domain"), w.handle, "")
+                files = [(args.path, False)]
+            s = Server(w.sftp_domain, w.handle, "")
 
             # Get credentials and connect.
             t = pbar.add_task("Connecting", total=None)
 
-            # Generate a new SFTP password from CodeRed Cloud API.
-            passwd = w.api_get_sftp_password()
-
             try:
                 # Connect to the webapp's server.
-                s.passwd = passwd
+                s.passwd = passwd_future.result()
                 s.connect()
 
                 # Initiate SFTP mode.
@@ -616,25 +729,58 @@ class Upload(Command):
                 pbar.update(t, total=1, completed=1)
 
                 # Copy files.
-                s.put(files, args.path, args.remote, progress=pbar)
+                s.put(
+                    files,
+                    args.path,
+                    args.remote,
+                    progress=pbar,
+                    max_workers=8,
+                )
             finally:
                 s.close()
+                pool.shutdown(wait=False)
 
 
-COMMANDS = [
-    Check,
-    Deploy,
-    Download,
-    Logs,
-    Restart,
-    Upload,
-]
+COMMANDS = {
+    Check.command: Check,
+    Deploy.command: Deploy,
+    Download.command: Download,
+    Logs.command: Logs,
+    Restart.command: Restart,
+    Upload.command: Upload,
+}
+"""
+Maps each subcommand name to its Command class, in display order.
+"""
+
 
+def _sniff_subcommand(argv: List[str]) -> Optional[str]:
+    """
+    Scan ``argv`` for the first token matching a known subcommand name.
 
-def make_parser(klass=SphinxArgumentParser) -> argparse.ArgumentParser:
+    Returns the subcommand name, or None if no known subcommand is present
+    (e.g. ``cr --help`` or an unrecognized command).
+    """
+    for token in argv:
+        if token in COMMANDS:
+            return token
+        # Stop at the first non-option token; it is the (unknown) subcommand.
+        if not token.startswith("-"):
+            return None
+    return None
+
+
+def make_parser(
+    klass=SphinxArgumentParser, command: Optional[str] = None
+) -> argparse.ArgumentParser:
     """
     Sets up argparse with all the subcommands and options.
 
+    If ``command`` names a known subcommand, only that subparser is built,
+    which avoids constructing the full argparse tree for the five commands
+    that are not being run. Otherwise all subparsers are built (needed for
+    the ``--help`` listing and for generating docs).
+
     This is in a separate function for compatibility with generating docs using
     ``sphinx-argparse``. For that reason, we are also defaulting to the non-rich
     SphinxArgumentParser because the sphinx-docs are unaware of rich's meta
@@ -679,7 +825,9 @@ def make_parser(klass=SphinxArgumentParser) -> argparse.ArgumentParser:
         title="Commands",
         dest="command",
     )
-    for c in COMMANDS:
+    for c in COMMANDS.values():
+        if command and c.command != command:
+            continue
         sp = subparsers.add_parser(
             name=c.command,
             description=c.help,
@@ -697,27 +845,41 @@ def runcli() -> None:
     Entrypoint into the command-line interface.
     """
 
-    # -- Parse and route the commands ------------------------------------------
+    # Fast path: print the version without building any parser. Disable
+    # logging as in the non-debug branch below, so the update check in
+    # ``main()`` cannot log through the unconfigured last-resort handler.
+    if len(sys.argv) == 2 and sys.argv[1] in ("-v", "--version"):
+        logging.disable(logging.CRITICAL)
+        CONSOLE.print(f"cr version {VERSION}")
+        return
 
-    commands_map = {}
-    for c in COMMANDS:
-        commands_map[c.command] = c
+    # -- Parse and route the commands ------------------------------------------
 
-    parser = make_parser(klass=RichArgumentParser)
+    parser = make_parser(
+        klass=RichArgumentParser,
+        command=_sniff_subcommand(sys.argv[1:]),
+    )
     args = parser.parse_args()
 
-    # Set up logging.
-    logging.basicConfig(
-        level=logging.DEBUG if args.debug else logging.CRITICAL,
-        format="%(message)s",
-        handlers=[
-            RichHandler(
-                console=CONSOLE,
-                show_time=False,
-                rich_tracebacks=True,
-            )
-        ],
-    )
+    # Set up logging. The RichHandler is only needed for debug output;
+    # otherwise disable logging entirely so every LOGGER call short-circuits
+    # without touching a handler.
+    if args.debug:
+        from rich.logging import RichHandler
+
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(message)s",
+            handlers=[
+                RichHandler(
+                    console=CONSOLE,
+                    show_time=False,
+                    rich_tracebacks=True,
+                )
+            ],
+        )
+    else:
+        logging.disable(logging.CRITICAL)
 
     # Version.
     if args.version:
@@ -730,10 +892,12 @@ def runcli() -> None:
         return
 
     # Run the sub-command.
-    commands_map[args.command].run(args)
+    COMMANDS[args.command].run(args)
 
 
 def main():
+    from cr.api import check_update
+
     try:
         runcli()
         check_update(CONSOLE_ERR)
@@ -5,11 +5,17 @@ Copyright (c) 2022-2024 CodeRed LLC.
 """
 
 import configparser
+import functools
 import os
+import re
 from pathlib import Path
 from pathlib import PurePosixPath
+from typing import Any
+from typing import Dict
+from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Tuple
 
 from cr import LOGGER
 
@@ -18,21 +24,92 @@ from cr import LOGGER
 # They should never be printed or logged.
 _SECRETS = ["token"]
 
+# Environment variable name for each secret key, built once instead of
+# formatted on every lookup.
+_SECRET_ENV = {k: f"CR_{k.upper()}" for k in _SECRETS}
+
 
 _CONFIG = configparser.ConfigParser(default_section="cr")
 
 
-def load_config(lp: List[Path] = []) -> List[str]:
+# Per-user config path, expanded once at import; the home directory does
+# not change within a process. The project-local ``.cr.ini`` is still
+# resolved per read because the working directory can change.
+_PERSONAL_CONFIG_PATH = Path("~/.cr.ini").expanduser().resolve()
+
+
+# Plain-dict snapshot of the parsed config, rebuilt on each (re-)read.
+# Lookups against it skip configparser's per-access interpolation, key
+# case-folding, and section-chain walking. Section dicts already include
+# the merged [cr] defaults; the "cr" entry holds the defaults themselves.
+_FLAT: Dict[str, Dict[str, str]] = {}
+
+
+# Memoized ``(key, webapp) -> value`` lookups, populated on first access and
+# cleared whenever the config files are (re-)read. Stores None for misses so
+# repeat misses also skip the ConfigParser walk.
+_CACHE: Dict[Tuple[str, str], Optional[str]] = {}
+
+# Sentinel distinguishing "not yet cached" from a cached miss. Typed Any so
+# it can be passed as the default to ``_CACHE.get`` below.
+_UNCACHED: Any = object()
+
+# Memoized parsed multi-line list values, keyed on ``(key, webapp)`` and
+# cleared whenever the config files are (re-)read. Stored as tuples so the
+# cached entries cannot be mutated through the returned lists.
+_PATH_LIST_CACHE: Dict[Tuple[str, str], Tuple[Path, ...]] = {}
+_POSIX_LIST_CACHE: Dict[Tuple[str, str], Tuple[PurePosixPath, ...]] = {}
+
+
+# Values parsed as True by ``config_bool``.
+_TRUTHY = frozenset({"yes", "on", "true", "1"})
+
+
+# Splits multi-line config values on any run of newlines.
+_RE_SPLIT_LINES = re.compile(r"[\r\n]+")
+
+
+def _split_lines(val: str) -> List[str]:
+    """
+    Splits a multi-line config value into stripped, non-empty lines.
+    """
+    return [
+        s for s in (x.strip(" \t") for x in _RE_SPLIT_LINES.split(val)) if s
+    ]
+
+
+def load_config(lp: Iterable[Path] = ()) -> List[str]:
     """
     Reads config files from pre-defined paths, plus any additional paths ``lp``.
+
+    Results are memoized keyed on each file's path, size, and mtime, so
+    repeated calls re-parse only when a file has actually changed.
     """
-    read = _CONFIG.read(
-        [
-            Path("~/.cr.ini").expanduser().resolve(),
-            Path(".cr.ini").resolve(),
-            *lp,
-        ]
-    )
+    key: List[Tuple[str, Optional[int], Optional[int]]] = []
+    for p in (_PERSONAL_CONFIG_PATH, Path(".cr.ini").resolve(), *lp):
+        try:
+            st = os.stat(p)
+            key.append((str(p), st.st_mtime_ns, st.st_size))
+        except OSError:
+            # Missing files are part of the key too, so creating one
+            # later invalidates the cache.
+            key.append((str(p), None, None))
+    return _load_config(tuple(key))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_config(
+    key: Tuple[Tuple[str, Optional[int], Optional[int]], ...],
+) -> List[str]:
+    _CACHE.clear()
+    _PATH_LIST_CACHE.clear()
+    _POSIX_LIST_CACHE.clear()
+    read = _CONFIG.read([p for p, _, _ in key])
+    _FLAT.clear()
+    for s in _CONFIG.sections():
+        # ``items`` merges the [cr] defaults and interpolates once.
+        _FLAT[s] = dict(_CONFIG.items(s))
+    _FLAT["cr"] = dict(_CONFIG.defaults())
     LOGGER.info("Read config files: %s", read)
     return read
 
@@ -52,21 +129,37 @@ def config(k, w: str = "cr", f: Optional[str] = None) -> Optional[str]:
 
     If the key is not found, return fallback ``f``.
     """
-    val = f
-
-    # Query the config files.
-    if w in _CONFIG:
-        val = _CONFIG[w].get(k, val)
-    else:
-        val = _CONFIG.defaults().get(k, val)
-
-    # Query secret configs from env vars to override files.
+    # Secrets may be overridden by environment variables, which can change
+    # between calls, so they bypass the cache. The env var wins, so when it
+    # is set the file lookup can be skipped entirely.
     if k in _SECRETS:
-        val = os.environ.get(f"CR_{k.upper()}", val)
+        val = os.environ.get(_SECRET_ENV[k])
+        if val is not None:
+            return val
+        val = _config_read(k, w)
+        if val is None:
+            return f
+        return val
+
+    val = _CACHE.get((k, w), _UNCACHED)
+    if val is _UNCACHED:
+        val = _config_read(k, w)
+        _CACHE[(k, w)] = val
+        LOGGER.debug("Config `%s`: `%s`", k, val)
+    if val is None:
+        return f
+    return val
 
-    LOGGER.debug("Config `%s`: `%s`", k, val)
 
-    return val
+def _config_read(k: str, w: str) -> Optional[str]:
+    """
+    Queries the parsed config files for key ``k`` in section ``w``, falling
+    back to the default [cr] section. Returns None if not found.
+    """
+    d = _FLAT.get(w)
+    if d is None:
+        d = _FLAT.get("cr", {})
+    return d.get(k)
 
 
 def config_bool(k, w: str = "cr", f: Optional[bool] = None) -> Optional[bool]:
@@ -77,13 +170,13 @@ def config_bool(k, w: str = "cr", f: Optional[bool] = None) -> Optional[bool]:
     val = config(k, w)
     if val is None:
         return f
-    return val.lower() in ["yes", "on", "true", "1"]
+    return val.lower() in _TRUTHY
 
 
 def config_path_list(k, w: str = "cr", f: List[Path] = []) -> List[Path]:
     """
     Queries a multi-line config (newline separated and indented) and returns
-    a list of resolved paths.
+    a list of absolute paths.
 
     Multi-lines should be formatted as so:
 
@@ -93,16 +186,20 @@ def config_path_list(k, w: str = "cr", f: List[Path] = []) -> List[Path]:
             line2
         another-key = ...
     """
-    lp = []
-    val = config(k, w)
-    if val:
-        for line in val.split("\n"):
-            line = line.strip(" \t\r\n")
-            if line:
-                lp.append(Path(line).expanduser().resolve())
-    if not lp:
+    cached = _PATH_LIST_CACHE.get((k, w))
+    if cached is None:
+        lp = []
+        val = config(k, w)
+        if val:
+            for line in _split_lines(val):
+                # ``abspath`` normalizes without the readlink syscalls a
+                # full ``resolve()`` performs per path component.
+                lp.append(Path(os.path.abspath(os.path.expanduser(line))))
+        cached = tuple(lp)
+        _PATH_LIST_CACHE[(k, w)] = cached
+    if not cached:
         return f
-    return lp
+    return list(cached)
 
 
 def config_pureposixpath_list(
@@ -120,13 +217,15 @@ def config_pureposixpath_list(
             line2
         another-key = ...
     """
-    lp = []
-    val = config(k, w)
-    if val:
-        for line in val.split("\n"):
-            line = line.strip(" \t\r\n")
-            if line:
+    cached = _POSIX_LIST_CACHE.get((k, w))
+    if cached is None:
+        lp = []
+        val = config(k, w)
+        if val:
+            for line in _split_lines(val):
                 lp.append(PurePosixPath(line))
-    if not lp:
+        cached = tuple(lp)
+        _POSIX_LIST_CACHE[(k, w)] = cached
+    if not cached:
         return f
-    return lp
+    return list(cached)
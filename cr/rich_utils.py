@@ -5,6 +5,7 @@ Copyright (c) 2022-2024 CodeRed LLC.
 """
 
 import argparse
+from typing import Dict
 from typing import Generator
 from typing import Iterable
 from typing import List
@@ -65,6 +66,17 @@ class CustomHighlighter(RegexHighlighter):
         r"`+(?P<code>[^`]*)`+",
     ]
 
+    def highlight(self, text: Text) -> None:
+        """
+        Override to skip the regex passes entirely when the text contains
+        neither a dash nor a backtick, which is true for most lines printed
+        above progress bars.
+        """
+        plain = text.plain
+        if "-" not in plain and "`" not in plain:
+            return
+        super().highlight(text)
+
 
 class Console(_Console):
     """
@@ -132,6 +144,12 @@ class Progress(_Progress):
     system codes (OSC) for progress indicators.
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Last OSC percentage emitted per task, so repeated updates that
+        # do not change the whole percentage skip the escape-code write.
+        self._last_osc: Dict[TaskID, int] = {}
+
     def add_task(self, *args, **kwargs) -> TaskID:
         """
         Override to initiate OSC progress indicator.
@@ -150,7 +168,9 @@ class Progress(_Progress):
 
         # If we have a total, show the percentage.
         elif task.total:
-            osc_progress(self.console, int(task.percentage))
+            pct = int(task.percentage)
+            self._last_osc[tid] = pct
+            osc_progress(self.console, pct)
 
         return tid
 
@@ -168,11 +188,30 @@ class Progress(_Progress):
 
         # Reset if completed.
         if task.total and task.completed >= task.total:
+            self._last_osc.pop(task_id, None)
             osc_reset(self.console)
 
-        # If we have a total, show the percentage.
+        # If we have a total, show the percentage if it changed.
         elif task.total:
-            osc_progress(self.console, int(task.percentage))
+            pct = int(task.percentage)
+            if self._last_osc.get(task_id) != pct:
+                self._last_osc[task_id] = pct
+                osc_progress(self.console, pct)
+
+
+def _iter_tables(group: Group) -> Generator[Table, None, None]:
+    """
+    Yields every ``Table`` nested anywhere within ``group``, using an
+    explicit stack rather than recursion.
+    """
+    stack = [group]
+    while stack:
+        g = stack.pop()
+        for renderable in g.renderables:
+            if isinstance(renderable, Table):
+                yield renderable
+            elif isinstance(renderable, Group):
+                stack.append(renderable)
 
 
 class RichArgparseFormatter(
@@ -400,15 +439,8 @@ class RichArgparseFormatter(
 
         renderables = Group(*self.renderables)
 
-        def iter_tables(group: Group) -> Generator[Table, None, None]:
-            for renderable in group.renderables:
-                if isinstance(renderable, Table):
-                    yield renderable
-                elif isinstance(renderable, Group):
-                    yield from iter_tables(renderable)
-
         col1_width = 0
-        for table in iter_tables(
+        for table in _iter_tables(
             renderables
         ):  # compute a unified width of all tables
             cells = table.columns[0].cells
@@ -418,7 +450,7 @@ class RichArgparseFormatter(
             col1_width = max(col1_width, table_col1_width)
         col1_width = min(col1_width, self._max_help_position)
         col2_width = self._width - col1_width
-        for table in iter_tables(renderables):  # apply the unified width
+        for table in _iter_tables(renderables):  # apply the unified width
             table.columns[0].width = col1_width
             table.columns[1].width = col2_width
 
@@ -7,15 +7,21 @@ installed, or the project is not in a git repository.
 Copyright (c) 2022-2024 CodeRed LLC.
 """
 
-import io
+import contextlib
+import functools
 import os
 import re
+import shutil
+import string
 from pathlib import Path
 from subprocess import PIPE
-from subprocess import Popen
+from subprocess import run
 from typing import IO
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Set
 from typing import Tuple
 from typing import Union
 
@@ -24,31 +30,68 @@ from cr import ConfigurationError
 from cr import DatabaseType
 
 
-EXCLUDE_DIRNAMES = ["__pycache__", "node_modules", "htmlcov", "venv"]
+EXCLUDE_DIRNAMES = frozenset(["__pycache__", "node_modules", "htmlcov", "venv"])
 """
-List of directory names to always exclude from deployments.
+Directory names to always exclude from deployments.
 """
 
+
+def is_excluded_name(name: str) -> bool:
+    """
+    Check whether a file or directory name is always excluded from
+    deployments and downloads: hidden names, and ``EXCLUDE_DIRNAMES``.
+    """
+    return name.startswith(".") or name in EXCLUDE_DIRNAMES
+
+
 TEMPLATE_PATH = Path(__file__).parent / "templates"
 """
 Templates directory included with this project.
 """
 
-URLSAFE_REGEX = re.compile(
-    r"^[a-zA-Z0-9]+[a-zA-Z0-9\-]+[a-zA-Z0-9]+$", flags=re.IGNORECASE
-)
+_ALNUM = frozenset(string.ascii_letters + string.digits)
+"""
+ASCII letters and numbers usable at the edges of a DNS/URL word.
+"""
+
+_URLSAFE = _ALNUM | {"-"}
+"""
+Characters usable within a DNS/URL word: letters, numbers, and dashes.
+"""
+
+_RE_BASEDIR_PATH = re.compile(r"^BASE_DIR\s+=\s+Path.+$", re.MULTILINE)
+"""
+Matches a Django >=3.1 style ``BASE_DIR = Path...`` settings line.
+"""
+
+_RE_BASEDIR_OS = re.compile(r"^BASE_DIR\s+=\s+os\..+$", re.MULTILINE)
+"""
+Matches a Django <3.1 or Wagtail style ``BASE_DIR = os.path...`` settings
+line.
+"""
+
+_RE_VIRTUAL_HOST = re.compile(r"os\.environ\[\s*[\'\"]VIRTUAL_HOST[\'\"]\s*\]")
+"""
+Matches a settings file reading the VIRTUAL_HOST environment variable.
+"""
+
+_RE_DB_HOST = re.compile(r"os\.environ\[\s*[\'\"]DB_HOST[\'\"]\s*\]")
 """
-Regular expression to determine if a word is usable in DNS/URLs. Letter or
-number + at least one other letter or number or dash + letter or number.
+Matches a settings file reading the DB_HOST environment variable.
 """
 
 
+@functools.lru_cache(maxsize=None)
 def get_command(program: str) -> Path:
     r"""
     Finds full path to a command on PATH given a command name.
     E.g. ``bash`` returns ``/bin/bash``;
     ``git`` might return ``C:\Program Files\Git\bin\git.exe``
 
+    Results are memoized, since callers such as the git helpers resolve
+    the same program name repeatedly within a process. Failed lookups are
+    not cached.
+
     :param str program:
         The program to search for. Must be an executable, not a shell built-in.
 
@@ -61,32 +104,45 @@ def get_command(program: str) -> Path:
     if Path(program).exists():
         return Path(program)
 
-    # Get list of executable extensions (Windows).
-    exts: List[str] = []
-    if os.environ.get("PATHEXT"):
-        exts = os.environ["PATHEXT"].split(";")
-
-    # Search paths for program.
-    for path in os.get_exec_path():
-        testpath = Path(path) / program
-        if testpath.exists():
-            LOGGER.debug("Found `%s` at `%s`", program, testpath)
-            return testpath
-        for ext in exts:
-            testpath = Path(path) / f"{program}{ext}"
-            if testpath.exists():
-                LOGGER.debug("Found `%s` at `%s`", program, testpath)
-                return testpath
+    # ``which`` walks the PATH, including PATHEXT extensions on Windows.
+    found = shutil.which(str(program))
+    if found:
+        LOGGER.debug("Found `%s` at `%s`", program, found)
+        return Path(found)
 
     raise FileNotFoundError(f"Could not find `{program}` on PATH")
 
 
+_FIXED_ENV: Optional[dict] = None
+
+
+def _fixed_env() -> dict:
+    """
+    Returns the environment used for subprocesses, computed on first use
+    and shared by reference thereafter (``Popen`` does not mutate it).
+
+    NOTE: PyInstaller adds an entry to LD_LIBRARY_PATH in env during python
+    runtime. This is needed for PyInstaller to work, but it can interfere with
+    subprocess execution as PyInstaller's LD_LIBRARY_PATH differs from the
+    system's LD_LIBRARY_PATH. Clear out that variable for the subprocess's
+    execution as a workaround, otherwise the subprocess might not be able to
+    load any dynamically linked libraries from the system, or might load the
+    wrong libraries from PyInstaller!
+    """
+    global _FIXED_ENV
+    if _FIXED_ENV is None:
+        _FIXED_ENV = {
+            k: v for k, v in os.environ.items() if k != "LD_LIBRARY_PATH"
+        }
+    return _FIXED_ENV
+
+
 def exec_proc(
     args: List[str],
     infile: Optional[Path] = None,
     outfile: Optional[Path] = None,
     outfile_mode: str = "w",
-    ok_exit_codes: List[int] = [0],
+    ok_exit_codes: Iterable[int] = (0,),
 ) -> Tuple[int, str, str]:
     """
     Executes a process on the local machine.
@@ -100,8 +156,8 @@ def exec_proc(
         Path to a file in which to save stdout as UTF8 text.
     :param str outfile_mode:
         Mode to use when writing to outfile.
-    :param List[int] ok_exit_codes:
-        The list of exit/return codes will not be logged as errors.
+    :param Iterable[int] ok_exit_codes:
+        Exit/return codes which will not be logged as errors.
 
     :return: Tuple of exit code, stdout, stderr.
     :rtype: Tuple[int, str, str]
@@ -110,54 +166,49 @@ def exec_proc(
         # Find program on PATH.
         args[0] = str(get_command(args[0]))
 
+    ok_codes = frozenset(ok_exit_codes)
+
     stdin: Union[IO, None] = None
     stdout: Union[IO, int] = PIPE
 
-    if infile:
-        LOGGER.debug("Opening `%s`.", infile)
-        stdin = open(infile, "r", encoding="utf8")
-    if outfile:
-        LOGGER.debug("Opening `%s`.", outfile)
-        stdout = open(outfile, outfile_mode, encoding="utf8")
-
-    # NOTE: PyInstaller adds an entry to LD_LIBRARY_PATH in env during python
-    # runtime. This is needed for PyInstaller to work, but it can interfere with
-    # subprocess execution as PyInstaller's LD_LIBRARY_PATH differs from the
-    # system's LD_LIBRARY_PATH. Clear out that variable for the subprocess's
-    # execution as a workaround, otherwise the subprocess might not be able to
-    # load any dynamically linked libraries from the system, or might load the
-    # wrong libraries from PyInstaller!
-    fixenv: dict = os.environ.copy()
-    if "LD_LIBRARY_PATH" in fixenv:
-        del fixenv["LD_LIBRARY_PATH"]
-    LOGGER.info("Running `%s`...", args)
-    LOGGER.debug("Running `%s` with ENV: %s", args, fixenv)
-    try:
-        with Popen(
+    # ``ExitStack`` closes the infile/outfile handles whether or not the
+    # subprocess raises.
+    with contextlib.ExitStack() as stack:
+        if infile:
+            LOGGER.debug("Opening `%s`.", infile)
+            stdin = stack.enter_context(open(infile, "r", encoding="utf8"))
+        if outfile:
+            LOGGER.debug("Opening `%s`.", outfile)
+            stdout = stack.enter_context(
+                open(outfile, outfile_mode, encoding="utf8")
+            )
+
+        fixenv = _fixed_env()
+        LOGGER.info("Running `%s`...", args)
+        LOGGER.debug("Running `%s` with ENV: %s", args, fixenv)
+        # Run process and capture output. Pipes are read as bytes and
+        # decoded once at the end, skipping text mode's per-line newline
+        # translation on large outputs. ``stdout`` is None when redirected
+        # to ``outfile``.
+        proc = run(
             args,
             stdin=stdin,
             stdout=stdout,
             stderr=PIPE,
-            universal_newlines=True,
             env=fixenv,
-        ) as proc:
-            # Run process and capture output.
-            com_stdout, com_stderr = proc.communicate()
-            # Log stdout to debug.
-            if com_stdout:
-                LOGGER.debug(com_stdout.strip())
-            # Log stderr to error, or debug.
-            if com_stderr and proc.returncode not in ok_exit_codes:
-                LOGGER.error(com_stderr.strip())
-            elif com_stderr:
-                LOGGER.debug(com_stderr.strip())
-    finally:
-        if isinstance(stdin, io.IOBase):
-            LOGGER.debug("Closing `%s`.", infile)
-            stdin.close()
-        if isinstance(stdout, io.IOBase):
-            LOGGER.debug("Closing `%s`.", outfile)
-            stdout.close()
+            check=False,
+        )
+
+    com_stdout = proc.stdout.decode("utf8", "replace") if proc.stdout else ""
+    com_stderr = proc.stderr.decode("utf8", "replace") if proc.stderr else ""
+    # Log stdout to debug.
+    if com_stdout:
+        LOGGER.debug(com_stdout.strip())
+    # Log stderr to error, or debug.
+    if com_stderr and proc.returncode not in ok_codes:
+        LOGGER.error(com_stderr.strip())
+    elif com_stderr:
+        LOGGER.debug(com_stderr.strip())
 
     return (
         proc.returncode,
@@ -170,11 +221,14 @@ def stdout_to_list(stdout: str) -> List[str]:
     """
     Cleans and splits newline delimited stdout to a list.
     """
-    stdout_list = []
-    clean = stdout.strip(" \r\n")
-    if clean:
-        stdout_list = clean.split("\n")
-    return stdout_list
+    # ``splitlines`` handles \r\n and \n in one C-level pass without an
+    # intermediate stripped copy; just trim blank edge lines.
+    lines = stdout.splitlines()
+    while lines and not lines[0].strip():
+        del lines[0]
+    while lines and not lines[-1].strip():
+        del lines[-1]
+    return lines
 
 
 def git_branch() -> str:
@@ -197,76 +251,99 @@ def git_uncommitted() -> List[str]:
     Checks for un-committed changes.
     Returns list of changed file names, or empty list if no changes.
     """
+    # NUL-delimited output skips git's filename quoting/escaping, and
+    # rename detection is pointless for a yes/no changes check.
     try:
-        code, out, err = exec_proc(["git", "diff", "--name-only", "HEAD"])
+        code, out, err = exec_proc(
+            ["git", "diff", "--name-only", "--no-renames", "-z", "HEAD"]
+        )
         if code != 0:
             return []
-        diff_list = stdout_to_list(out)
-        return diff_list
+        return [s for s in out.split("\0") if s]
     except FileNotFoundError:
         return []
 
 
-def git_unpushed() -> List[str]:
+def git_unpushed(branch: Optional[str] = None) -> List[str]:
     """
     Checks for un-pushed changes.
     Returns list of changed file names, or empty list if no changes.
+
+    Pass ``branch`` if the current branch is already known, to skip a
+    redundant git invocation.
     """
     # Get current branch.
-    b = git_branch()
+    b = branch or git_branch()
     if not b:
         return []
 
     # Check for changes against the remote branch.
     try:
         code, out, err = exec_proc(
-            ["git", "diff", "--name-only", f"origin/{b}"],
+            ["git", "diff", "--name-only", "--no-renames", "-z", f"origin/{b}"],
         )
         if code != 0:
             return []
-        diff_list = stdout_to_list(out)
-        return diff_list
+        return [s for s in out.split("\0") if s]
     except FileNotFoundError:
         return []
 
 
-def git_ignored(p: Optional[Path] = None) -> List[Path]:
+def git_ignored(p: Optional[Path] = None) -> Set[Path]:
     """
-    Returns a list of absolute file and directory paths ignored by git.
+    Returns a set of absolute file and directory paths ignored by git.
+
+    The set is built from a single bulk ``git ls-files`` call, so membership
+    tests against it are O(1) regardless of how many ignore patterns the
+    repository uses.
     """
-    lp: List[Path] = []
+    sp: Set[Path] = set()
 
-    # Build the command.
-    cmd = ["git", "ls-files", "--others", "--directory"]
+    # Build the command. ``--ignored --exclude-standard`` lists only paths
+    # matched by the standard ignore files; plain ``--others`` would also
+    # sweep up untracked-but-not-ignored files. NUL-delimited output skips
+    # git's filename quoting.
+    cmd = [
+        "git",
+        "ls-files",
+        "--others",
+        "--ignored",
+        "--exclude-standard",
+        "--directory",
+        "-z",
+    ]
     if p:
         cmd.append(str(p))
 
     # Run the command.
-    # If git exits with an error, or is not on the path, return an empty list.
+    # If git exits with an error, or is not on the path, return an empty set.
     try:
         code, out, err = exec_proc(cmd)
         if code != 0:
-            return lp
+            return sp
     except FileNotFoundError:
-        return lp
+        return sp
 
-    # Split stdout by newline.
-    ls = stdout_to_list(out)
+    # Split stdout by NUL, and convert each entry to a Path.
+    for s in out.split("\0"):
+        if s:
+            sp.add(Path(s).resolve())
+    LOGGER.debug("Git ignored: `%s`.", sp)
 
-    # Convert each entry to a Path.
-    for s in ls:
-        lp.append(Path(s.strip("\r\n")).resolve())
-    LOGGER.debug("Git ignored: `%s`.", lp)
-
-    return lp
+    return sp
 
 
 def paths_to_deploy(
-    r: Path, e: List[Path] = [], i: List[Path] = []
-) -> List[Path]:
+    r: Path, e: Iterable[Path] = (), i: Iterable[Path] = ()
+) -> Iterator[Tuple[Path, bool]]:
     """
-    Walk the root local directory ``r`` and build a list of absolute file
-    and directory paths which should be included in the deployment.
+    Walk the root local directory ``r`` and generate ``(path, is_dir)``
+    tuples of absolute file and directory paths which should be included
+    in the deployment. The bool spares consumers a stat call per entry,
+    as the walk already knows which entries are directories.
+
+    Paths are yielded lazily as the walk progresses, so consumers (e.g. an
+    upload loop) can begin working before the whole tree has been scanned.
 
     Paths in ``e`` will be excluded.
 
@@ -274,69 +351,99 @@ def paths_to_deploy(
     However, a path in ``i`` which is a subpath of an exluded directory in ``e``
     will still be ignored.
 
-    Any file paths in the returned list must also include their parent directory
-    paths within ``r``, so that consumers of this list will know to create them.
-    """
-    lp: List[Path] = []
-    for root, dirs, files in os.walk(r):
-        # If subdir is excluded, delete it from the list, so ``os`` will not
-        # traverse it. Otherwise, append to the list.
-        dirs_copy = dirs.copy()
-        for d in dirs_copy:
-            dp = Path(os.path.join(root, d))
-            dpr = dp.resolve()
+    Any file paths must also be preceded by their parent directory paths
+    within ``r``, so that consumers will know to create them.
+    """
+    # Resolve the root once; every entry path is then built by string
+    # joins against it, avoiding a ``realpath`` syscall per entry.
+    # Excludes/includes are snapshotted as string sets so membership
+    # tests are O(1) string hashes rather than Path comparisons.
+    e_set = frozenset(str(p) for p in e)
+    i_set = frozenset(str(p) for p in i)
+    stack = [os.path.realpath(r)]
+    while stack:
+        parent = stack.pop()
+        try:
+            with os.scandir(parent) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        # Yield directories before files, so consumers know to create
+        # them. ``DirEntry.is_dir`` is answered from the directory read
+        # itself on most platforms, with no extra stat call. Like
+        # ``os.walk``, a symlink to a directory is treated as a
+        # directory but never descended into.
+        file_paths: List[str] = []
+        for entry in entries:
+            full = entry.path
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                file_paths.append(full)
             # Force add if included.
-            if dpr in i:
-                LOGGER.debug("Force include %s", dpr)
-                lp.append(dpr)
-            # Delete from the list if excluded, so it will not be walked.
-            elif (
-                dpr in e
-                or dpr.name.startswith(".")
-                or dpr.name in EXCLUDE_DIRNAMES
-            ):
-                LOGGER.debug("Force exclude %s", dpr)
-                dirs.remove(d)
+            elif full in i_set:
+                LOGGER.debug("Force include %s", full)
+                yield (Path(full), True)
+                if not entry.is_symlink():
+                    stack.append(full)
+            # Skip if excluded, and do not walk it.
+            elif full in e_set or is_excluded_name(entry.name):
+                LOGGER.debug("Force exclude %s", full)
             # Otherwise add by default.
             else:
-                lp.append(dpr)
+                yield (Path(full), True)
+                if not entry.is_symlink():
+                    stack.append(full)
 
-        # Append any files.
-        for f in files:
-            fp = Path(os.path.join(root, f))
-            fpr = fp.resolve()
+        # Yield any files.
+        for full in file_paths:
             # Force add if included.
-            if fpr in i:
-                LOGGER.debug("Force include %s", fpr)
-                lp.append(fpr)
+            if full in i_set:
+                LOGGER.debug("Force include %s", full)
+                yield (Path(full), False)
             # Skip if excluded.
-            elif fpr in e:
-                LOGGER.debug("Force exclude %s", fpr)
-                pass
+            elif full in e_set:
+                LOGGER.debug("Force exclude %s", full)
             # Otherwise add by default.
             else:
-                lp.append(fpr)
-
-    return lp
+                yield (Path(full), False)
 
 
+@functools.lru_cache(maxsize=None)
 def template(t: str) -> str:
     """
     Read file ``t`` from the templates directory and return it as a string.
+
+    Memoized; the bundled templates never change during a process, and the
+    settings fixers may ask for the same one several times.
     """
     return (TEMPLATE_PATH / t).read_text()
 
 
 def is_urlsafe(value: str) -> bool:
     """
-    Determines if value is a valid URL, subdomain, etc.
+    Determines if value is a valid URL, subdomain, etc. Must be at least 3
+    characters: letter or number + at least one other letter or number or
+    dash + letter or number.
     """
-    return bool(URLSAFE_REGEX.match(value))
+    return (
+        len(value) >= 3
+        and value[0] in _ALNUM
+        and value[-1] in _ALNUM
+        and all(c in _URLSAFE for c in value)
+    )
 
 
+@functools.lru_cache(maxsize=32)
 def check_handle(value: str) -> bool:
     """
     Check if the provided ``value`` could be a valid webapp handle.
+
+    Memoized, as the same handle is typically checked repeatedly within a
+    single process.
     """
     return is_urlsafe(value) and len(value) <= 32
 
@@ -367,7 +474,7 @@ def django_manage_check(p: Path) -> None:
     """
     Checks for existence of manage.py file.
     """
-    if not (p / "manage.py").is_file():
+    if not os.path.isfile(os.path.join(p, "manage.py")):
         raise FileNotFoundError("manage.py")
 
 
@@ -375,7 +482,7 @@ def django_requirements_check(p: Path) -> None:
     """
     Checks for existence of requirements.txt file.
     """
-    if not (p / "requirements.txt").is_file():
+    if not os.path.isfile(os.path.join(p, "requirements.txt")):
         raise FileNotFoundError("requirements.txt")
 
 
@@ -383,7 +490,7 @@ def django_settings_check(p: Path) -> None:
     """
     Given a path to a settings file ``p``, check the contents of the settings file.
     """
-    if not p.is_file():
+    if not os.path.isfile(p):
         raise FileNotFoundError(p)
     contents = p.read_text()
     if "VIRTUAL_HOST" not in contents or "DB_HOST" not in contents:
@@ -422,43 +529,40 @@ def django_settings_fix(p: Path, db: DatabaseType) -> None:
     settings_str = settings_base.read_text()
     # Rewrite BASE_DIR to accurately reflect the location.
     # Django >=3.1 settings have ``BASE_DIR = Path``
-    settings_str = re.sub(
-        r"^BASE_DIR\s+=\s+Path.+$",
+    settings_str = _RE_BASEDIR_PATH.sub(
         r"BASE_DIR = Path(__file__).resolve().parent.parent.parent",
         settings_str,
-        flags=re.MULTILINE,
     )
     # Django <3.1 and Wagtail settings have ``BASE_DIR = os.path``
-    settings_str = re.sub(
-        r"^BASE_DIR\s+=\s+os\..+$",
+    settings_str = _RE_BASEDIR_OS.sub(
         r"from pathlib import Path\n"
         r"BASE_DIR = Path(__file__).resolve().parent.parent.parent",
         settings_str,
-        flags=re.MULTILINE,
     )
     LOGGER.info("Writing to %s", settings_base)
     settings_base.write_text(settings_str)
 
-    # Create desired settings file.
-    if not p.exists():
-        p.write_text(template("settings-top.py.txt"))
+    # Read (or create in memory) the desired settings file once; append any
+    # missing settings in memory, and write only if something changed.
+    if p.exists():
+        settings_str = p.read_text()
+        modified = False
+    else:
+        settings_str = template("settings-top.py.txt")
+        modified = True
 
     # If settings file does not look correct, append our recommended.
-    settings_str = p.read_text()
-    if not re.findall(
-        r"os\.environ\[\s*[\'\"]VIRTUAL_HOST[\'\"]\s*\]",
-        settings_str,
-    ):
+    if not _RE_VIRTUAL_HOST.search(settings_str):
         settings_str += "\n"
         settings_str += template("settings.py.txt")
-    if not re.findall(
-        r"os\.environ\[\s*[\'\"]DB_HOST[\'\"]\s*\]",
-        settings_str,
-    ):
+        modified = True
+    if not _RE_DB_HOST.search(settings_str):
         settings_str += "\n"
         settings_str += template(f"settings-{db}.py.txt")
-    LOGGER.info("Writing to %s", p)
-    p.write_text(settings_str)
+        modified = True
+    if modified:
+        LOGGER.info("Writing to %s", p)
+        p.write_text(settings_str)
 
 
 def django_wsgi_check(p: Path, project: str):
@@ -466,7 +570,7 @@ def django_wsgi_check(p: Path, project: str):
     Checks for existence of a wsgi.py file in the project folder.
     """
     wsgi = p / project / "wsgi.py"
-    if not wsgi.is_file():
+    if not os.path.isfile(wsgi):
         wsgi_relative = wsgi.relative_to(p)
         raise FileNotFoundError(wsgi_relative)
 
@@ -475,9 +579,14 @@ def django_wsgi_find(p: Path) -> str:
     """
     Find a subdirectory of ``p`` that contains a wsgi.py file.
     """
-    for item in p.iterdir():
-        if item.is_dir() and (item / "wsgi.py").is_file():
-            return item.name
+    # ``scandir`` answers ``is_dir`` from the directory read itself on
+    # most platforms, so only candidate wsgi.py files cost a stat.
+    with os.scandir(p) as it:
+        for entry in it:
+            if entry.is_dir() and os.path.isfile(
+                os.path.join(entry.path, "wsgi.py")
+            ):
+                return entry.name
     raise FileNotFoundError("wsgi.py")
 
 
@@ -485,7 +594,7 @@ def html_index_check(p: Path) -> None:
     """
     Checks for existence of an index.html file.
     """
-    if not (p / "index.html").is_file():
+    if not os.path.isfile(os.path.join(p, "index.html")):
         raise FileNotFoundError("index.html")
 
 
@@ -496,7 +605,6 @@ def wagtail_settings_fix(p: Path) -> None:
     """
     settings_str = p.read_text()
     if "WAGTAILADMIN_BASE_URL" not in settings_str:
-        settings_str = p.read_text()
         settings_str += "\n"
         settings_str += template("settings-wagtail.py.txt")
         LOGGER.info("Writing to %s", p)
@@ -508,5 +616,5 @@ def wordpress_wpconfig_check(p: Path) -> None:
     Checks for existence of a wp-config.php file.
     TODO: Inspect the file similar to Django settings functionality.
     """
-    if not (p / "wp-config.php").is_file():
+    if not os.path.isfile(os.path.join(p, "wp-config.php")):
         raise FileNotFoundError("wp-config.php")
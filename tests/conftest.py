@@ -0,0 +1,18 @@
+import pytest
+
+
+def pytest_configure(config):
+    # Register the marker so runs without pytest-xdist installed do not
+    # warn about it being unknown.
+    config.addinivalue_line(
+        "markers",
+        "xdist_group(name): group tests onto the same xdist worker.",
+    )
+
+
+def pytest_collection_modifyitems(items):
+    # With ``--dist=loadgroup``, pin each module's tests to a single xdist
+    # worker so the network-, subprocess-, and disk-bound modules run in
+    # parallel with each other rather than interleaved on one worker.
+    for item in items:
+        item.add_marker(pytest.mark.xdist_group(item.module.__name__))
@@ -1,10 +1,29 @@
+import os
 import unittest
+from unittest import mock
 
 from cr.api import check_update
 
 
 class TestApi(unittest.TestCase):
-    def test_check_update(self):
+    @mock.patch("cr.api._write_update_cache")
+    @mock.patch("cr.api._read_update_cache", return_value=None)
+    @mock.patch("cr.api.request_json")
+    def test_check_update(self, m_request, m_read, m_write):
+        # Stub out the network and the on-disk cache, so the test is
+        # deterministic and runs offline.
+        m_request.return_value = (200, {"tag_name": "v999.0.0"})
+        has_update, version = check_update()
+        self.assertTrue(has_update)
+        self.assertEqual(version, "999.0.0")
+        m_request.assert_called_once()
+        m_write.assert_called_once_with("999.0.0")
+
+    @unittest.skipUnless(
+        os.environ.get("CR_TEST_NETWORK"),
+        "Set CR_TEST_NETWORK=1 to test against the live GitHub API.",
+    )
+    def test_check_update_network(self):
         # Test that check_update works, and returns a value.
         has_update, version = check_update()
         self.assertIsInstance(has_update, bool)
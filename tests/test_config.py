@@ -1,3 +1,5 @@
+import shutil
+import tempfile
 import unittest
 from pathlib import Path
 from pathlib import PurePosixPath
@@ -28,33 +30,43 @@ test_str = demo_str
 """
 
 
-class TestCli(unittest.TestCase):
-    def setUp(self):
+# Resolved once at import, rather than per test.
+_CWD = Path(".").resolve()
+
+
+class TestConfig(unittest.TestCase):
+    # Nothing in these tests mutates the loaded config, so the fixture
+    # files are written and parsed once per class rather than per test.
+    @classmethod
+    def setUpClass(cls):
         # Check for and/or create config files.
-        self.delete_home = False
-        self.conf_home = Path("~/.cr.ini").expanduser().resolve()
-        if not self.conf_home.exists():
-            self.delete_home = True
-            self.conf_home.touch()
-        self.delete_cwd = False
-        self.conf_cwd = Path(".cr.ini").resolve()
-        if not self.conf_cwd.exists():
-            self.delete_cwd = True
-            self.conf_cwd.touch()
-        # Write a custom config file.
-        self.conf_custom = Path(".test-config.ini").resolve()
-        with open(self.conf_custom, "w") as f:
+        cls.delete_home = False
+        cls.conf_home = Path("~/.cr.ini").expanduser().resolve()
+        if not cls.conf_home.exists():
+            cls.delete_home = True
+            cls.conf_home.touch()
+        cls.delete_cwd = False
+        cls.conf_cwd = Path(".cr.ini").resolve()
+        if not cls.conf_cwd.exists():
+            cls.delete_cwd = True
+            cls.conf_cwd.touch()
+        # Write a custom config file in a private temp dir, so parallel
+        # test workers cannot collide on a shared CWD file.
+        cls.tmp_dir = Path(tempfile.mkdtemp())
+        cls.conf_custom = cls.tmp_dir / "test-config.ini"
+        with open(cls.conf_custom, "w") as f:
             f.write(TEST_CONFIG)
         # Load the config.
-        load_config([self.conf_custom])
+        load_config([cls.conf_custom])
 
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         # Delete the config files.
-        self.conf_custom.unlink()
-        if self.delete_home:
-            self.conf_home.unlink()
-        if self.delete_cwd:
-            self.conf_cwd.unlink()
+        shutil.rmtree(cls.tmp_dir)
+        if cls.delete_home:
+            cls.conf_home.unlink()
+        if cls.delete_cwd:
+            cls.conf_cwd.unlink()
 
     def test_loadconfig(self):
         paths = load_config([self.conf_custom])
@@ -64,25 +76,35 @@ class TestCli(unittest.TestCase):
         self.assertTrue(str(self.conf_custom) in paths)
 
     def test_config(self):
-        self.assertEqual(config("test_str"), "cr_str")
-        self.assertEqual(config("test_str", "demo"), "demo_str")
-        # Test invalid webapp (should fallback to [cr])
-        self.assertEqual(config("test_str", "junk"), "cr_str")
-        # Test fallback.
-        self.assertEqual(config("junk", f="junkval"), "junkval")
+        cases = [
+            ("test_str", "cr", None, "cr_str"),
+            ("test_str", "demo", None, "demo_str"),
+            # Invalid webapp (should fallback to [cr]).
+            ("test_str", "junk", None, "cr_str"),
+            # Missing key (should return the fallback).
+            ("junk", "cr", "junkval", "junkval"),
+        ]
+        for k, w, f, expected in cases:
+            with self.subTest(k=k, w=w):
+                self.assertEqual(config(k, w, f=f), expected)
 
     def test_bool(self):
-        self.assertTrue(config_bool("test_bool_true", "demo"))
-        self.assertFalse(config_bool("test_bool_false", "demo"))
-        # Test fallback.
-        self.assertTrue(config_bool("junk", f=True))
-        self.assertFalse(config_bool("junk", f=False))
+        cases = [
+            ("test_bool_true", "demo", None, True),
+            ("test_bool_false", "demo", None, False),
+            # Missing key (should return the fallback).
+            ("junk", "cr", True, True),
+            ("junk", "cr", False, False),
+        ]
+        for k, w, f, expected in cases:
+            with self.subTest(k=k, f=f):
+                self.assertEqual(config_bool(k, w, f=f), expected)
 
     def test_path_list(self):
         paths = config_path_list("test_paths")
         self.assertEqual(
             paths,
-            [Path(".").resolve(), Path("test_config.py").resolve()],
+            [_CWD, _CWD / "test_config.py"],
         )
         # Test fallback.
         paths = config_path_list("junk", f=[Path("/")])
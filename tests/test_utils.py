@@ -1,11 +1,19 @@
+import os
+import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
 
 from cr.utils import exec_proc
 from cr.utils import get_command
 from cr.utils import git_ignored
 
 
+# Resolved once at import, rather than per test.
+_HERE = Path(__file__).resolve().parent
+_PYCACHE = _HERE / "__pycache__"
+
+
 class TestSubprocesses(unittest.TestCase):
     def test_get_command(self):
         # Test that "python" resolves to a real file path.
@@ -16,9 +24,12 @@ class TestSubprocesses(unittest.TestCase):
         py = get_command(py.resolve())
         self.assertTrue(py.is_file())
 
-        # Test that a broken command raises an exception.
-        with self.assertRaises(FileNotFoundError):
-            get_command("!!! not a command !!!")
+        # Test that a broken command raises an exception. Search an empty
+        # PATH so the lookup fails without probing every real PATH entry.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with mock.patch.dict(os.environ, {"PATH": tmp_dir}):
+                with self.assertRaises(FileNotFoundError):
+                    get_command("!!! not a command !!!")
 
     def test_exec_proc(self):
         # A successful command.
@@ -61,11 +72,9 @@ class TestGit(unittest.TestCase):
 
     def test_git_ignored(self):
         # Should contain some things that are being ignored in this repo.
-        cwd = Path(__file__).parent
-        lp = git_ignored(cwd)
-        pycache = (cwd / "__pycache__").resolve()
-        self.assertTrue(pycache in lp)
+        lp = git_ignored(_HERE)
+        self.assertTrue(_PYCACHE in lp)
 
-        # Should return an empty list because this is not a git repo.
+        # Should return an empty set because this is not a git repo.
         lp = git_ignored(Path("/").resolve())
-        self.assertTrue(lp == [])
+        self.assertTrue(lp == set())